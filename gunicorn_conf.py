@@ -0,0 +1,20 @@
+import multiprocessing
+import os
+
+# Run from the repository root: gunicorn -c gunicorn_conf.py
+chdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "src")
+wsgi_app = "app:app"
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", max(2, multiprocessing.cpu_count())))
+# Split the cores between workers instead of giving each one a thread per core.
+os.environ.setdefault("INFERENCE_THREADS", str(max(1, multiprocessing.cpu_count() // workers)))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = True
+
+def when_ready(server):
+    # Load the pipeline (and JIT the fused scorer) once in the master so
+    # every forked worker inherits it copy-on-write.
+    from model import get_fused_scorer, get_model
+
+    get_model()
+    get_fused_scorer()
@@ -1,15 +1,52 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Query
 from pydantic import BaseModel, Field
-import joblib
+from typing import Annotated
+from model import get_model, load_models, predict_proba, reload_models
+import asyncio
+import os
+import re
 import time
 
-app = FastAPI(title="Toxicity Classifier API")
+try:
+    import ahocorasick
+except ImportError:  # optional: pip install pyahocorasick
+    ahocorasick = None
 
-MODEL = joblib.load("models/toxicity_model.joblib")
+RESPONSE_CACHE_SIZE = 1024
+RESPONSE_CACHE_TTL_S = 60.0
+SCORE_CACHE_SIZE = 10_000
+MAX_BATCH = int(os.environ.get("MAX_BATCH_SIZE", "32"))
+BATCH_TIMEOUT_S = float(os.environ.get("MAX_BATCH_WAIT_MS", "8")) / 1000.0
+INFERENCE_THREADS = int(os.environ.get("INFERENCE_THREADS", os.cpu_count() or 1))
+MAX_BATCH_TEXTS = 256
+
+# Matching runs against text.lower(), so the terms are folded once here.
+TOXIC_TERMS = tuple(term.lower() for term in ("idiot", "stupid", "loser", "shut up", "hate", "worthless"))
+TOXIC_TERM_TABLE = tuple((term, len(term)) for term in TOXIC_TERMS)
+
+def _build_term_automaton():
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    for term, n in TOXIC_TERM_TABLE:
+        automaton.add_word(term, (term, n))
+    automaton.make_automaton()
+    return automaton
+
+TOXIC_TERM_AUTOMATON = _build_term_automaton()
+TOXIC_TERM_PATTERN = r"\b(?:" + "|".join(re.escape(term) for term in sorted(TOXIC_TERMS, key=len, reverse=True)) + r")\b"
+TOXIC_TERM_RE = re.compile(TOXIC_TERM_PATTERN)
+TOXIC_TERM_RE_IGNORECASE = re.compile(TOXIC_TERM_PATTERN, re.IGNORECASE)
 
 class PredictRequest(BaseModel):
     text: str = Field(..., min_length=1, max_length=5000)
 
+class BatchPredictRequest(BaseModel):
+    texts: list[Annotated[str, Field(min_length=1, max_length=5000)]] = Field(..., min_length=1, max_length=MAX_BATCH_TEXTS)
+
 class RationaleSpan(BaseModel):
     span: str
     start: int
@@ -24,58 +61,361 @@ class PredictResponse(BaseModel):
     redacted_text: str | None = None
     meta: dict
 
+class BatchPredictResponse(BaseModel):
+    results: list[PredictResponse]
+
+class HealthResponse(BaseModel):
+    status: str
+    model_version: str
+
+class FlushResponse(BaseModel):
+    status: str
+
+class TTLCache:
+    """Bounded LRU mapping whose entries expire `ttl` seconds after insertion."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+class PredictBatcher:
+    """Coalesces concurrent score requests into batched `predict_proba` calls.
+
+    A single consumer task drains up to `max_batch` queued texts, waiting at
+    most `timeout` seconds after the first one arrives, and hands the batch to
+    `executor` (the loop's default pool when None). Up to `max_inflight`
+    batches run at once; each caller's future resolves with its
+    (non_toxic, toxic) row.
+    """
+
+    def __init__(self, max_batch: int, timeout: float, max_inflight: int):
+        self.max_batch = max_batch
+        self.timeout = timeout
+        self.max_inflight = max_inflight
+        self.executor = None
+        self._loop = None
+        self._queue = None
+        self._slots = None
+        self._task = None
+        self._inflight = set()
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_inflight)
+        self._task = loop.create_task(self._run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    async def score(self, text: str) -> tuple[float, float]:
+        self.start()
+        fut = self._loop.create_future()
+        await self._queue.put((text, fut))
+        return await fut
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.timeout
+        while len(batch) < self.max_batch:
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            # While every slot is busy, new requests keep queueing and the
+            # next batch comes out larger.
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+            task = self._loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        try:
+            texts = [text for text, _ in batch]
+            proba = await self._loop.run_in_executor(self.executor, predict_proba, texts)
+        except Exception as exc:
+            for _, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        finally:
+            self._slots.release()
+        for (_, fut), row in zip(batch, proba):
+            if not fut.done():
+                fut.set_result((float(row[0]), float(row[1])))
+
+RESPONSE_CACHE = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_S)
+SCORE_CACHE = TTLCache(SCORE_CACHE_SIZE, RESPONSE_CACHE_TTL_S)
+BATCHER = PredictBatcher(MAX_BATCH, BATCH_TIMEOUT_S, INFERENCE_THREADS)
+# Scores for text with no usable tokens; filled per loaded model, never expires.
+EMPTY_SCORES = {}
+
+async def score_empty_text():
+    """Score the empty string on the inference executor and remember the result."""
+    loop = asyncio.get_running_loop()
+    proba = (await loop.run_in_executor(BATCHER.executor, predict_proba, [""]))[0]
+    EMPTY_SCORES.update(non_toxic=float(proba[0]), toxic=float(proba[1]))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load once per worker here rather than at import, so tooling that only
+    # imports the module (pytest collection, --reload parents) stays cheap.
+    load_models()
+    app.state.executor = ThreadPoolExecutor(max_workers=INFERENCE_THREADS, thread_name_prefix="inference")
+    BATCHER.executor = app.state.executor
+    BATCHER.start()
+    await score_empty_text()
+    yield
+    await BATCHER.stop()
+    BATCHER.executor = None
+    app.state.executor.shutdown()
+
+app = FastAPI(title="Toxicity Classifier API", lifespan=lifespan)
+
+def normalize_text(text: str) -> str:
+    # The vectorizer never tokenizes the surrounding whitespace, and when it
+    # lowercases it uses str.lower(), so these variants always score identically.
+    text = text.strip()
+    return text.lower() if get_model().named_steps["tfidf"].lowercase else text
+
 def simple_scores(text: str):
-    proba = MODEL.predict_proba([text])[0]
-    return {"non_toxic": float(proba[0]), "toxic": float(proba[1])}
+    key = normalize_text(text)
+    pair = SCORE_CACHE.get(key)
+    if pair is None:
+        proba = predict_proba([key])[0]
+        pair = (float(proba[0]), float(proba[1]))
+        SCORE_CACHE.set(key, pair)
+    return {"non_toxic": pair[0], "toxic": pair[1]}
+
+async def batched_scores(text: str):
+    key = normalize_text(text)
+    # The vectorizer only keeps tokens of two or more word characters, so
+    # anything shorter scores exactly like the empty string; skip the queue.
+    if len(key) < 2:
+        if not EMPTY_SCORES:
+            await score_empty_text()
+        return dict(EMPTY_SCORES)
+    pair = SCORE_CACHE.get(key)
+    if pair is None:
+        pair = await BATCHER.score(key)
+        SCORE_CACHE.set(key, pair)
+    return {"non_toxic": pair[0], "toxic": pair[1]}
+
+async def scores_for_texts(texts: list[str]):
+    """Score many texts with at most one model call for the uncached ones."""
+    keys = [normalize_text(text) for text in texts]
+    pairs = {}
+    for key in keys:
+        if key not in pairs:
+            pairs[key] = SCORE_CACHE.get(key)
+    misses = [key for key, pair in pairs.items() if pair is None]
+    if misses:
+        loop = asyncio.get_running_loop()
+        proba = await loop.run_in_executor(BATCHER.executor, predict_proba, misses)
+        for key, row in zip(misses, proba):
+            pairs[key] = (float(row[0]), float(row[1]))
+            SCORE_CACHE.set(key, pairs[key])
+    return [{"non_toxic": pairs[key][0], "toxic": pairs[key][1]} for key in keys]
 
 def choose_label(scores: dict, threshold: float):
     return "toxic" if scores["toxic"] >= threshold else "non_toxic"
 
+def _is_whole_word(text: str, start: int, end: int) -> bool:
+    before = text[start - 1] if start > 0 else " "
+    after = text[end] if end < len(text) else " "
+    return not (before.isalnum() or before == "_") and not (after.isalnum() or after == "_")
+
+def _match_terms_automaton(lower: str, top_k: int):
+    matches = []
+    seen = set()
+    for last, (term, n) in TOXIC_TERM_AUTOMATON.iter(lower):
+        start = last - n + 1
+        if term in seen or not _is_whole_word(lower, start, last + 1):
+            continue
+        seen.add(term)
+        matches.append((start, last + 1))
+        if len(matches) >= top_k:
+            break
+    return matches
+
+def _match_terms_regex(text: str, top_k: int, pattern: re.Pattern = TOXIC_TERM_RE):
+    if top_k == 1:
+        m = pattern.search(text)
+        return [m.span()] if m else []
+    matches = []
+    seen = set()
+    for m in pattern.finditer(text):
+        term = m.group().lower()
+        if term in seen:
+            continue
+        seen.add(term)
+        matches.append(m.span())
+        if len(matches) >= top_k:
+            break
+    return matches
+
 def find_rationale_spans(text: str, top_k: int = 1):
-    toxic_terms = ["idiot", "stupid", "loser", "shut up", "hate", "worthless"]
     lower = text.lower()
-    spans = []
-    for term in toxic_terms:
-        i = lower.find(term)
-        if i >= 0:
-            spans.append(RationaleSpan(span=text[i:i+len(term)], start=i, end=i+len(term), weight=1.0))
-            if len(spans) >= top_k:
-                break
+    if len(lower) != len(text):
+        # Some characters lowercase to several code points ("İ" -> "i̇"), which
+        # would shift every offset after them; match the original text instead.
+        matches = _match_terms_regex(text, top_k, TOXIC_TERM_RE_IGNORECASE)
+    elif TOXIC_TERM_AUTOMATON is not None:
+        matches = _match_terms_automaton(lower, top_k)
+    else:
+        matches = _match_terms_regex(lower, top_k)
+    # Hand spans out in start order so redact() can splice without re-sorting.
+    matches.sort()
+    # Plain dicts: PredictResponse validates them into RationaleSpan once, on the way out.
+    spans = [{"span": text[i:j], "start": i, "end": j, "weight": 1.0} for i, j in matches]
     return spans if spans else None
 
-def redact(text: str, spans: list[RationaleSpan] | None, mode: str = "token") -> str | None:
+class _MaskTable(dict):
+    """str.translate table mapping alphanumeric code points to '*'.
+
+    ASCII is filled in up front; any other code point is classified on first
+    sight and remembered, so translate() stays a C-level dict lookup.
+    """
+
+    def __missing__(self, cp: int) -> int:
+        value = ord("*") if chr(cp).isalnum() else cp
+        self[cp] = value
+        return value
+
+_MASK_TABLE = _MaskTable({cp: ord("*") if chr(cp).isalnum() else cp for cp in range(128)})
+
+def _mask(segment: str) -> str:
+    return segment.translate(_MASK_TABLE)
+
+def redact(text: str, spans: list[dict] | None, mode: str = "token") -> str | None:
+    """Replace each span in `text`; spans must be sorted by start, as find_rationale_spans returns them."""
     if not spans:
         return None
-    chars = list(text)
-    for s in sorted(spans, key=lambda x: x.start, reverse=True):
-        segment = text[s.start:s.end]
-        replacement = "[REDACTED]" if mode == "token" else "".join("*" if c.isalnum() else c for c in segment)
-        chars[s.start:s.end] = list(replacement)
-    return "".join(chars)
-
-@app.get("/healthz")
-def health():
+    parts = []
+    prev_end = 0
+    for s in spans:
+        start, end = s["start"], s["end"]
+        parts.append(text[prev_end:start])
+        parts.append("[REDACTED]" if mode == "token" else _mask(text[start:end]))
+        prev_end = end
+    parts.append(text[prev_end:])
+    return "".join(parts)
+
+def elapsed_ms(t0_ns: int) -> float:
+    """Milliseconds since a perf_counter_ns() reading, rounded for the response meta."""
+    return round((time.perf_counter_ns() - t0_ns) / 1_000_000, 2)
+
+def build_result(text: str, scores: dict, threshold: float, include_rationale: bool, redact_flagged: bool):
+    label = choose_label(scores, threshold)
+    # The rationale explains a toxic decision; benign text skips the term scan.
+    wants_rationale = include_rationale and label == "toxic"
+    rationale = find_rationale_spans(text) if wants_rationale else None
+    redacted = redact(text, rationale) if (redact_flagged and rationale) else None
+    return {
+        "label": label,
+        "confidence": scores[label],
+        "scores": scores,
+        "rationale": rationale,
+        "redacted_text": redacted,
+    }
+
+@app.get("/healthz", response_model=HealthResponse)
+async def health():
     return {"status": "ok", "model_version": "toy-0.1"}
 
+@app.post("/admin/flush", response_model=FlushResponse)
+async def flush_caches():
+    # Reload first so a swapped model file takes effect, then drop the results
+    # the old one produced. Loading is slow, so keep it off the event loop.
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(BATCHER.executor, reload_models)
+    await score_empty_text()
+    RESPONSE_CACHE.clear()
+    SCORE_CACHE.clear()
+    return {"status": "flushed"}
+
 @app.post("/predict", response_model=PredictResponse)
-def predict(
+async def predict(
     req: PredictRequest,
     include_rationale: bool = Query(True),
     redact_flagged: bool = Query(False),
     threshold: float = Query(0.5, ge=0, le=1),
 ):
-    t0 = time.time()
-    scores = simple_scores(req.text)
-    label = choose_label(scores, threshold)
-    rationale = find_rationale_spans(req.text) if include_rationale else None
-    redacted = redact(req.text, rationale) if (redact_flagged and rationale) else None
-    latency_ms = (time.time() - t0) * 1000.0
-
-    return PredictResponse(
-        label=label,
-        confidence=scores[label],
-        scores=scores,
-        rationale=rationale,
-        redacted_text=redacted,
-        meta={"latency_ms": round(latency_ms, 2), "threshold_used": threshold},
-    )
+    t0 = time.perf_counter_ns()
+    cache_key = (req.text, threshold, include_rationale, redact_flagged)
+    result = RESPONSE_CACHE.get(cache_key)
+    if result is None:
+        scores = await batched_scores(req.text)
+        result = build_result(req.text, scores, threshold, include_rationale, redact_flagged)
+        RESPONSE_CACHE.set(cache_key, result)
+    latency_ms = elapsed_ms(t0)
+
+    # Returned as a dict: FastAPI validates it against response_model once and
+    # serializes straight to JSON bytes via pydantic-core.
+    return {
+        **result,
+        "meta": {"latency_ms": latency_ms, "threshold_used": threshold},
+    }
+
+@app.post("/predict_batch", response_model=BatchPredictResponse)
+async def predict_batch(
+    req: BatchPredictRequest,
+    include_rationale: bool = Query(True),
+    redact_flagged: bool = Query(False),
+    threshold: float = Query(0.5, ge=0, le=1),
+):
+    t0 = time.perf_counter_ns()
+    all_scores = await scores_for_texts(req.texts)
+    results = [
+        build_result(text, scores, threshold, include_rationale, redact_flagged)
+        for text, scores in zip(req.texts, all_scores)
+    ]
+    latency_ms = elapsed_ms(t0)
+
+    meta = {"latency_ms": latency_ms, "threshold_used": threshold}
+    return {"results": [{**result, "meta": meta} for result in results]}
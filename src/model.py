@@ -0,0 +1,174 @@
+from functools import lru_cache
+from pathlib import Path
+import joblib
+import math
+import numpy as np
+import os
+import re
+from sklearn.linear_model import LogisticRegression
+
+try:
+    from numba import njit
+except ImportError:  # optional: pip install numba
+    njit = None
+
+MODELS_DIR = Path(__file__).resolve().parent.parent / "models"
+MODEL_PATH = MODELS_DIR / "toxicity_model.joblib"
+QUANTIZE_WEIGHTS = os.environ.get("QUANTIZE_WEIGHTS", "0") == "1"
+
+def cast_to_float32(pipeline):
+    """Run the TF-IDF + LogisticRegression pipeline in float32 for inference."""
+    vectorizer = pipeline.named_steps["tfidf"]
+    classifier = pipeline.named_steps["clf"]
+    vectorizer.dtype = np.float32
+    if classifier.coef_.dtype != np.float32:
+        classifier.coef_ = classifier.coef_.astype(np.float32)
+        classifier.intercept_ = classifier.intercept_.astype(np.float32)
+    # Inference never writes to the weights; fail loudly if anything tries.
+    classifier.coef_.setflags(write=False)
+    classifier.intercept_.setflags(write=False)
+    return pipeline
+
+@lru_cache(maxsize=1)
+def get_model():
+    """Load the sklearn pipeline once per process."""
+    # Read fully into memory rather than memory-mapping: a mapping would see
+    # train_model.py rewriting the file underneath a running server.
+    return cast_to_float32(joblib.load(MODEL_PATH))
+
+def _sigmoid(z):
+    # Branch on the sign so exp() never overflows, however large |z| gets.
+    if z >= 0.0:
+        return 1.0 / (1.0 + math.exp(-z))
+    e = math.exp(z)
+    return e / (1.0 + e)
+
+def _score_numeric(idxs, tfs, idf, weights, scale, bias):
+    """sigmoid(bias + scale * weights . l2_normalize(tfs * idf)) over the non-zero features."""
+    dot = 0.0
+    norm = 0.0
+    for k in range(idxs.size):
+        x = tfs[k] * idf[idxs[k]]
+        dot += x * weights[idxs[k]]
+        norm += x * x
+    if norm > 0.0:
+        dot /= math.sqrt(norm)
+    return _sigmoid(dot * scale + bias)
+
+if njit is not None:
+    _sigmoid = njit(cache=True, fastmath=True)(_sigmoid)
+    _score_numeric = njit(cache=True, fastmath=True)(_score_numeric)
+
+class FusedScorer:
+    """TF-IDF + binary LogisticRegression scored straight from the fitted weights.
+
+    Mirrors TfidfVectorizer.transform (word n-grams, raw or sublinear tf, idf,
+    L2 norm) followed by LogisticRegression.predict_proba, without sklearn's
+    per-call validation and sparse-matrix construction.
+
+    With `quantize=True` the weights are stored as int8 with one shared scale,
+    trading a small probability error (labels rarely move) for a quarter of
+    the weight bytes touched per score.
+    """
+
+    def __init__(self, pipeline, quantize: bool = False):
+        vectorizer = pipeline.named_steps["tfidf"]
+        classifier = pipeline.named_steps["clf"]
+        self.lowercase = vectorizer.lowercase
+        self.token_re = re.compile(vectorizer.token_pattern)
+        self.ngram_range = vectorizer.ngram_range
+        self.sublinear_tf = vectorizer.sublinear_tf
+        self.vocab = vectorizer.vocabulary_
+        self.idf = np.asarray(vectorizer.idf_, dtype=np.float32)
+        weights = np.asarray(classifier.coef_[0], dtype=np.float32)
+        self.scale = 1.0
+        if quantize:
+            self.scale = float(np.abs(weights).max()) / 127.0 or 1.0
+            weights = np.round(weights / self.scale).astype(np.int8)
+        self.weights = weights
+        self.bias = float(classifier.intercept_[0])
+        if njit is not None:
+            # Compile (or load from the on-disk cache) now, not on the first request.
+            empty = np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.float32)
+            _score_numeric(*empty, self.idf, self.weights, self.scale, self.bias)
+
+    @staticmethod
+    def supports(pipeline) -> bool:
+        vectorizer = pipeline.named_steps.get("tfidf")
+        classifier = pipeline.named_steps.get("clf")
+        return (
+            vectorizer is not None
+            # Only LogisticRegression turns its decision function into a
+            # sigmoid probability; other linear models with a 1-row coef_
+            # (LinearSVC, SGDClassifier) have none or a different one.
+            and isinstance(classifier, LogisticRegression)
+            and getattr(classifier, "multi_class", "auto") != "multinomial"
+            and getattr(classifier, "coef_", None) is not None
+            and classifier.coef_.shape[0] == 1
+            and vectorizer.input == "content"
+            and vectorizer.analyzer == "word"
+            and vectorizer.preprocessor is None
+            and vectorizer.tokenizer is None
+            and vectorizer.strip_accents is None
+            and vectorizer.stop_words is None
+            and not vectorizer.binary
+            and vectorizer.use_idf
+            and vectorizer.norm == "l2"
+        )
+
+    def _term_counts(self, text: str) -> dict:
+        if self.lowercase:
+            text = text.lower()
+        tokens = self.token_re.findall(text)
+        min_n, max_n = self.ngram_range
+        counts = {}
+        for n in range(min_n, max_n + 1):
+            for i in range(len(tokens) - n + 1):
+                j = self.vocab.get(tokens[i] if n == 1 else " ".join(tokens[i:i + n]))
+                if j is not None:
+                    counts[j] = counts.get(j, 0) + 1
+        return counts
+
+    def score(self, text: str) -> float:
+        """Probability of the positive (toxic) class."""
+        counts = self._term_counts(text)
+        z = self.bias
+        if counts:
+            idxs = np.fromiter(counts.keys(), dtype=np.intp, count=len(counts))
+            tfs = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+            if self.sublinear_tf:
+                tfs = 1.0 + np.log(tfs)
+            if njit is not None:
+                return _score_numeric(idxs, tfs, self.idf, self.weights, self.scale, z)
+            x = tfs * self.idf[idxs]
+            z += float(x @ self.weights[idxs]) * self.scale / math.sqrt(float(x @ x))
+        return _sigmoid(z)
+
+    def predict_proba(self, texts: list[str]):
+        toxic = np.array([self.score(text) for text in texts])
+        return np.column_stack((1.0 - toxic, toxic))
+
+@lru_cache(maxsize=1)
+def get_fused_scorer():
+    """FusedScorer for the loaded pipeline, or None if its config is unsupported."""
+    pipeline = get_model()
+    return FusedScorer(pipeline, quantize=QUANTIZE_WEIGHTS) if FusedScorer.supports(pipeline) else None
+
+def load_models():
+    """Load the pipeline and every scorer it enables, reusing any already loaded."""
+    get_model()
+    get_fused_scorer()
+
+def reload_models():
+    """Forget the loaded pipeline and scorers and load them again from disk."""
+    get_model.cache_clear()
+    get_fused_scorer.cache_clear()
+    load_models()
+
+def predict_proba(texts: list[str]):
+    # Always pick the engine from configuration, never from batch size, so a
+    # text scores the same however many others it was batched with.
+    scorer = get_fused_scorer()
+    if scorer is not None:
+        return scorer.predict_proba(texts)
+    return get_model().predict_proba(texts)
@@ -1,10 +1,16 @@
 from fastapi.testclient import TestClient
+import asyncio
 import sys
 import os
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from app import app
+import app as app_module
+from app import app, BATCHER, RESPONSE_CACHE, _mask, _match_terms_regex, find_rationale_spans, normalize_text, redact, simple_scores
+from model import QUANTIZE_WEIGHTS, FusedScorer, get_model, predict_proba
+
+# int8 weights (QUANTIZE_WEIGHTS=1) deliberately trade a little precision.
+PARITY_TOL = 1e-2 if QUANTIZE_WEIGHTS else 1e-5
 
 client = TestClient(app)
 
@@ -50,3 +56,188 @@ def test_predict_with_redaction():
 def test_predict_empty_text():
     resp = client.post("/predict", json={"text": ""})
     assert resp.status_code == 422
+
+def test_predict_repeated_request_is_stable():
+    first = client.post("/predict", json={"text": "You are an idiot!"}).json()
+    second = client.post("/predict", json={"text": "You are an idiot!"}).json()
+    assert first["label"] == second["label"]
+    assert first["scores"] == second["scores"]
+    assert first["rationale"] == second["rationale"]
+
+def test_admin_flush():
+    client.post("/predict", json={"text": "thank you"})
+    before = get_model()
+    resp = client.post("/admin/flush")
+    assert resp.status_code == 200
+    assert resp.json()["status"] == "flushed"
+    # The model file is read again, so a swapped model takes effect.
+    assert get_model() is not before
+    resp = client.post("/predict", json={"text": "thank you"})
+    assert resp.status_code == 200
+
+def test_batcher_matches_single_scores():
+    texts = ["You are an idiot!", "thank you", "have a great day"]
+
+    async def score_all():
+        results = await asyncio.gather(*(BATCHER.score(t) for t in texts))
+        await BATCHER.stop()
+        return results
+
+    results = asyncio.run(score_all())
+    for text, (non_toxic, toxic) in zip(texts, results):
+        expected = simple_scores(text)
+        assert abs(non_toxic - expected["non_toxic"]) < 1e-6
+        assert abs(toxic - expected["toxic"]) < 1e-6
+
+def test_rationale_matches_whole_words_only():
+    assert find_rationale_spans("whatever you say") is None
+    spans = find_rationale_spans("Stop it, IDIOT.")
+    assert spans is not None
+    assert spans[0] == {"span": "IDIOT", "start": 9, "end": 14, "weight": 1.0}
+
+def test_regex_fallback_matches_in_text_order():
+    assert _match_terms_regex("shut up, you stupid loser", 2) == [(0, 7), (13, 19)]
+    assert _match_terms_regex("whatever", 1) == []
+    assert _match_terms_regex("whatever, loser", 1) == [(10, 15)]
+
+def test_redact_multiple_spans():
+    text = "shut up, you stupid loser"
+    spans = find_rationale_spans(text, top_k=3)
+    assert redact(text, spans) == "[REDACTED], you [REDACTED] [REDACTED]"
+    assert redact(text, spans, mode="mask") == "**** **, you ****** *****"
+
+def test_predict_proba_matches_sklearn_pipeline():
+    texts = ["You are an idiot!", "Thank you for your help", "SHUT UP", ""]
+    expected = get_model().predict_proba(texts)
+    got = predict_proba(texts)
+    assert abs(got - expected).max() < PARITY_TOL
+
+def test_predict_proba_matches_sklearn_on_non_ascii_text():
+    texts = ["Du bist ein Idiotø", "idiotø", "İİİ you idiot", "naïve stupid café", "日本語 loser"]
+    expected = get_model().predict_proba(texts)
+    got = predict_proba(texts)
+    assert abs(got - expected).max() < PARITY_TOL
+
+def _fail_if_model_runs(monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError("short text reached the model")
+
+    monkeypatch.setattr(BATCHER, "score", fail)
+    monkeypatch.setattr(app_module, "predict_proba", fail)
+
+def test_predict_short_text_skips_model(monkeypatch):
+    expected = simple_scores("")
+    RESPONSE_CACHE.clear()
+    _fail_if_model_runs(monkeypatch)
+    resp = client.post("/predict", json={"text": " x "})
+    assert resp.status_code == 200
+    assert resp.json()["scores"] == expected
+
+def test_predict_short_text_skips_model_after_flush(monkeypatch):
+    # The flush empties SCORE_CACHE; the empty-text scores must survive it.
+    client.post("/admin/flush")
+    expected = predict_proba([""])[0]
+    _fail_if_model_runs(monkeypatch)
+    resp = client.post("/predict", json={"text": " x "})
+    assert resp.status_code == 200
+    assert resp.json()["scores"] == {"non_toxic": expected[0], "toxic": expected[1]}
+
+def test_predict_rationale_only_for_toxic_label():
+    resp = client.post("/predict?threshold=0.9", json={"text": "You are an idiot!"})
+    data = resp.json()
+    assert data["label"] == "non_toxic"
+    assert data["rationale"] is None
+
+def test_lifespan_runs_inference_on_dedicated_executor():
+    with TestClient(app) as lifespan_client:
+        assert BATCHER.executor is app.state.executor
+        resp = lifespan_client.post("/predict", json={"text": "you are a loser"})
+        assert resp.status_code == 200
+    assert BATCHER.executor is None
+
+def test_scores_are_shared_across_case_and_whitespace():
+    assert simple_scores("  You are an IDIOT!\n") == simple_scores("you are an idiot!")
+
+def test_normalization_follows_vectorizer_lowercase(monkeypatch):
+    assert normalize_text("  You are an IDIOT!\n") == "you are an idiot!"
+    monkeypatch.setattr(get_model().named_steps["tfidf"], "lowercase", False)
+    assert normalize_text("  You are an IDIOT!\n") == "You are an IDIOT!"
+
+def test_predict_batch():
+    texts = ["You are an idiot!", "Thank you for your help", "you are an IDIOT!"]
+    resp = client.post("/predict_batch?redact_flagged=true", json={"texts": texts})
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert len(results) == 3
+    single = client.post("/predict?redact_flagged=true", json={"text": texts[0]}).json()
+    assert results[0]["label"] == single["label"]
+    assert results[0]["redacted_text"] == single["redacted_text"]
+    assert results[0]["scores"] == results[2]["scores"]
+
+def test_predict_batch_rejects_empty_items():
+    assert client.post("/predict_batch", json={"texts": []}).status_code == 422
+    assert client.post("/predict_batch", json={"texts": ["ok", ""]}).status_code == 422
+
+def test_mask_keeps_punctuation_and_handles_unicode():
+    assert _mask("shut-up!") == "****-**!"
+    assert _mask("wörth_less") == "*****_****"
+
+def test_fused_scorer_matches_sklearn_pipeline():
+    pipeline = get_model()
+    assert FusedScorer.supports(pipeline)
+    scorer = FusedScorer(pipeline)
+    texts = ["You are an idiot!", "idiot idiot, shut up loser", "Thank you for your help", "", "zzz qqq"]
+    assert abs(scorer.predict_proba(texts) - pipeline.predict_proba(texts)).max() < 1e-5
+
+def test_fused_scorer_only_supports_logistic_regression():
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    from sklearn.linear_model import SGDClassifier
+    from sklearn.pipeline import Pipeline
+    from sklearn.svm import LinearSVC
+
+    texts = ["you are an idiot", "thank you", "shut up loser", "have a nice day"]
+    labels = [1, 0, 1, 0]
+    for clf in (LinearSVC(), SGDClassifier(loss="hinge"), SGDClassifier(loss="modified_huber")):
+        pipeline = Pipeline([("tfidf", TfidfVectorizer()), ("clf", clf)]).fit(texts, labels)
+        assert not FusedScorer.supports(pipeline)
+
+def test_fused_scorer_saturates_instead_of_overflowing():
+    scorer = FusedScorer(get_model())
+    scorer.bias = -1000.0
+    assert scorer.score("") == 0.0
+    scorer.bias = 1000.0
+    assert scorer.score("") == 1.0
+
+def test_quantized_fused_scorer_stays_close():
+    pipeline = get_model()
+    scorer = FusedScorer(pipeline, quantize=True)
+    assert scorer.weights.dtype.name == "int8"
+    texts = ["You are an idiot!", "Shut up, loser", "Thank you for your help", "Have a wonderful time"]
+    expected = pipeline.predict_proba(texts)
+    got = scorer.predict_proba(texts)
+    assert abs(got - expected).max() < 1e-2
+    assert (got.argmax(axis=1) == expected.argmax(axis=1)).all()
+
+def test_batched_score_does_not_depend_on_batch_neighbours():
+    async def alone():
+        result = await BATCHER.score("du bist ein idiotø")
+        await BATCHER.stop()
+        return result
+
+    async def together():
+        result, _ = await asyncio.gather(BATCHER.score("du bist ein idiotø"), BATCHER.score("hello there"))
+        await BATCHER.stop()
+        return result
+
+    assert asyncio.run(alone()) == asyncio.run(together())
+
+def test_rationale_offsets_survive_length_changing_lowercase():
+    text = "İİİ you idiot, stupid"
+    assert find_rationale_spans(text, top_k=2) == [
+        {"span": "idiot", "start": 8, "end": 13, "weight": 1.0},
+        {"span": "stupid", "start": 15, "end": 21, "weight": 1.0},
+    ]
+    resp = client.post("/predict?redact_flagged=true", json={"text": text})
+    data = resp.json()
+    assert data["rationale"][0]["span"] == "idiot"
+    assert data["redacted_text"] == "İİİ you [REDACTED], stupid"
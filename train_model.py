@@ -2,6 +2,7 @@ from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.linear_model import LogisticRegression
 from sklearn.pipeline import Pipeline
 import joblib
+import os
 
 texts = [
     "You are an idiot!",
@@ -23,5 +24,8 @@ pipe = Pipeline([
 ])
 
 pipe.fit(texts, labels)
-joblib.dump(pipe, "models/toxicity_model.joblib")
+# Write beside the target and rename, so a server reloading the model never
+# reads a half-written file.
+joblib.dump(pipe, "models/toxicity_model.joblib.tmp")
+os.replace("models/toxicity_model.joblib.tmp", "models/toxicity_model.joblib")
 print("✓ Saved toxicity_model.joblib to models/")